@@ -1,9 +1,18 @@
+import atexit
+import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from celery import Celery
+from celery.signals import after_setup_logger, worker_process_init, worker_process_shutdown
 
 BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
 
+# With late acks Redis redelivers any message unacked for this long, so it must outlast the
+# longest task time limit (batch conversions run well past the one-hour default)
+VISIBILITY_TIMEOUT = int(os.getenv("CELERY_VISIBILITY_TIMEOUT", 6 * 3600))
+
 celery_app = Celery(
     "docx_converter",
     broker=BROKER_URL,
@@ -12,11 +21,67 @@ celery_app = Celery(
 )
 
 celery_app.conf.update(
-    task_serializer="json",
-    accept_content=["json"],
-    result_serializer="json",
+    task_serializer="msgpack",
+    # json stays accepted so messages queued by older producers still drain.
+    accept_content=["msgpack", "json"],
+    result_serializer="msgpack",
     timezone="UTC",
     enable_utc=True,
     task_acks_late=True,
+    task_reject_on_worker_lost=True,
+    # One message per process at a time so long conversions don't strand queued work
+    worker_prefetch_multiplier=1,
+    worker_concurrency=os.cpu_count(),
+    # Recycle pool processes to cap descriptors leaked by LibreOffice runs
+    worker_max_tasks_per_child=200,
+    task_soft_time_limit=150,
+    task_time_limit=180,
     broker_connection_retry_on_startup=True,
-)
\ No newline at end of file
+    # Reuse Redis connections for publishing and result storage instead of reconnecting
+    broker_pool_limit=50,
+    broker_transport_options={
+        "max_connections": 50,
+        "socket_keepalive": True,
+        "visibility_timeout": VISIBILITY_TIMEOUT,
+    },
+    redis_max_connections=50,
+    result_backend_transport_options={"socket_keepalive": True, "retry_on_timeout": True},
+)
+
+# Log records are handed to a background listener so tasks only pay for an enqueue
+_log_handlers = []
+_log_listener = None
+
+class _InProcessQueueHandler(QueueHandler):
+    # QueueHandler.prepare formats the message (and any traceback) in the calling thread so
+    # records can be pickled; this queue never leaves the process, so leave that to the listener
+    def prepare(self, record):
+        return record
+
+def _start_log_listener(logger):
+    global _log_listener
+    log_queue = queue.SimpleQueue()
+    _log_listener = QueueListener(log_queue, *_log_handlers, respect_handler_level=True)
+    logger.handlers = [_InProcessQueueHandler(log_queue)]
+    _log_listener.start()
+
+def _stop_log_listener(**kwargs):
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
+
+@after_setup_logger.connect
+def setup_queue_logging(logger, **kwargs):
+    _log_handlers[:] = logger.handlers
+    _start_log_listener(logger)
+    atexit.register(_stop_log_listener)
+
+@worker_process_init.connect
+def restart_queue_logging(**kwargs):
+    # The listener thread does not survive the fork into pool processes
+    if _log_handlers:
+        _start_log_listener(logging.getLogger())
+
+# Pool processes exit without running atexit hooks, so flush on shutdown explicitly
+worker_process_shutdown.connect(_stop_log_listener)
\ No newline at end of file
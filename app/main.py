@@ -1,13 +1,25 @@
+import logging
+import os
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from .database import engine, Base
+from .models import upgrade_schema
 from .routers import jobs
 
+# uvicorn only configures its own loggers; without this the app's INFO records are dropped
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+
 Base.metadata.create_all(bind=engine)
+upgrade_schema(engine)
 
 app = FastAPI(
     title="Bulk Docx to PDF Converter",
     description="Asynchronous microservice for batch document conversion.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.include_router(jobs.router)
@@ -1,7 +1,7 @@
 import uuid
 import enum
 from datetime import datetime, timezone
-from sqlalchemy import Column, String, DateTime, Enum, ForeignKey, Integer, Uuid
+from sqlalchemy import Column, String, DateTime, Enum, ForeignKey, Integer, Uuid, Index, inspect, text
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -20,16 +20,19 @@ class Job(Base):
     __tablename__ = "jobs"
 
     id = Column(Uuid(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    status = Column(Enum(JobStatus), default=JobStatus.PENDING)
+    status = Column(Enum(JobStatus), default=JobStatus.PENDING, index=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     finished_at = Column(DateTime, nullable=True)
     
     zip_path = Column(String, nullable=True)
+    zip_sha256 = Column(String(64), nullable=True)
 
     files = relationship("JobFile", back_populates="job", cascade="all, delete-orphan")
 
 class JobFile(Base):
     __tablename__ = "job_files"
+    # Also serves plain job_id lookups, so job_id needs no index of its own
+    __table_args__ = (Index("ix_jobfile_job_status", "job_id", "status"),)
 
     id = Column(Integer, primary_key=True, index=True)
     job_id = Column(Uuid(as_uuid=True), ForeignKey("jobs.id"))
@@ -37,4 +40,18 @@ class JobFile(Base):
     status = Column(Enum(FileStatus), default=FileStatus.PENDING)
     error_message = Column(String, nullable=True)
 
-    job = relationship("Job", back_populates="files")
\ No newline at end of file
+    job = relationship("Job", back_populates="files")
+
+def upgrade_schema(bind):
+    """Bring a database created by an earlier version up to these models.
+
+    create_all only creates missing tables, so columns and indexes added to existing tables
+    are applied here. Each step is skipped once done, so this is safe to run on every start.
+    """
+    with bind.begin() as conn:
+        columns = {column["name"] for column in inspect(conn).get_columns("jobs")}
+        if "zip_sha256" not in columns:
+            conn.execute(text("ALTER TABLE jobs ADD COLUMN zip_sha256 VARCHAR(64)"))
+        for table in (Job.__table__, JobFile.__table__):
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
@@ -1,21 +1,49 @@
+import logging
 import os
 import shutil
 import uuid
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, BackgroundTasks, Request
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-from ..database import get_db
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, BackgroundTasks, Request, Response
+from fastapi.responses import FileResponse, ORJSONResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+from ..database import get_async_db
 from ..models import Job, JobStatus
 from .. import tasks 
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/api/v1/jobs", tags=["Jobs"])
 
 STORAGE_PATH = os.getenv("STORAGE_PATH", "./storage")
 
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+
+def _save_upload(src, path):
+    """Write an uploaded file to path, in-kernel when the upload was spooled to disk."""
+    with open(path, "wb") as dst:
+        # Starlette spools uploads over 1 MB to a temporary file that has a real descriptor
+        if getattr(src, "_rolled", False) and hasattr(os, "sendfile"):
+            try:
+                offset = src.tell()
+                size = os.fstat(src.fileno()).st_size
+                while offset < size:
+                    sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except OSError:
+                # Platforms without file-to-file sendfile fall back to a buffered copy
+                dst.seek(0)
+                dst.truncate()
+        shutil.copyfileobj(src, dst, length=UPLOAD_CHUNK_SIZE)
+
 @router.post("", status_code=202)
-def submit_job(
+async def submit_job(
     file: UploadFile = File(...), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     if not file.filename.endswith(".zip"):
         raise HTTPException(status_code=400, detail="Only .zip files are allowed.")
@@ -26,27 +54,35 @@ def submit_job(
     os.makedirs(input_dir, exist_ok=True)
 
     zip_location = os.path.join(job_dir, "upload.zip")
-    with open(zip_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Disk writes and the broker publish block, so keep them off the event loop
+    await run_in_threadpool(_save_upload, file.file, zip_location)
 
     new_job = Job(id=job_id, status=JobStatus.PENDING)
     db.add(new_job)
-    db.commit()
+    await db.commit()
 
-    tasks.process_incoming_job.delay(str(job_id), zip_location)
+    # The errback fails the job if the worker processing it is killed, e.g. by the hard time limit
+    await run_in_threadpool(
+        tasks.process_incoming_job.apply_async,
+        (str(job_id), zip_location),
+        link_error=tasks.fail_job_task.s(str(job_id)),
+    )
 
     return {"job_id": str(job_id), "status": "PENDING"}
 
 
 
 @router.get("/{job_id}")
-def get_job_status(job_id: uuid.UUID, request: Request, db: Session = Depends(get_db)):
-    job = db.query(Job).filter(Job.id == job_id).first()
+async def get_job_status(job_id: uuid.UUID, request: Request, db: AsyncSession = Depends(get_async_db)):
+    # Load the job and its files in one round-trip; relationships cannot lazy-load on an AsyncSession
+    result = await db.execute(select(Job).options(joinedload(Job.files)).where(Job.id == job_id))
+    job = result.unique().scalar_one_or_none()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
+    # orjson encodes UUIDs, enums and datetimes natively, so skip jsonable_encoder
     response = {
-        "job_id": str(job.id),
+        "job_id": job.id,
         "status": job.status,
         "created_at": job.created_at,
         "finished_at": job.finished_at,
@@ -59,25 +95,37 @@ def get_job_status(job_id: uuid.UUID, request: Request, db: Session = Depends(ge
     if job.status == JobStatus.COMPLETED:
         response["download_url"] = str(request.url_for("download_job_result", job_id=job_id))
 
-    return response
+    return ORJSONResponse(response)
 
 
 
 @router.get("/{job_id}/download")
-def download_job_result(job_id: uuid.UUID, db: Session = Depends(get_db)):
-    print("Downloading job result for job_id:", job_id)
-    job = db.query(Job).filter(Job.id == job_id).first()
+async def download_job_result(job_id: uuid.UUID, request: Request, db: AsyncSession = Depends(get_async_db)):
+    logger.info("Downloading job result for job_id: %s", job_id)
+    job = await db.get(Job, job_id)
     
-    if not job or job.status != JobStatus.COMPLETED:
+    if not job or job.status != JobStatus.COMPLETED or not job.zip_path:
         raise HTTPException(status_code=400, detail="Job not ready or failed")
+
+    headers = {"Cache-Control": "private, max-age=3600"}
+    if job.zip_sha256:
+        headers["ETag"] = f'"{job.zip_sha256}"'
+        # Revalidation is answered from the DB without touching storage
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
     
     full_path = os.path.join(STORAGE_PATH, job.zip_path)
     
-    if not os.path.exists(full_path):
+    try:
+        stat_result = await run_in_threadpool(os.stat, full_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=500, detail="File missing from storage")
 
+    # Passing stat_result saves FileResponse from stat-ing the file a second time
     return FileResponse(
         path=full_path, 
         filename=f"converted_{job_id}.zip",
-        media_type="application/zip"
+        media_type="application/zip",
+        stat_result=stat_result,
+        headers=headers
     )
\ No newline at end of file
@@ -1,19 +1,314 @@
+import atexit
+import contextlib
+import hashlib
+import itertools
+import logging
+import mmap
 import os
+import shutil
+import signal
 import subprocess
+import time
+import types
 import zipfile
+import zlib
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from celery import chord
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.signals import worker_init, worker_process_shutdown
+from sqlalchemy import insert, update
 from .celery_worker import celery_app
-from .database import SessionLocal
+from .database import ScopedSession
 from .models import Job, JobFile, JobStatus, FileStatus
 
+logger = logging.getLogger(__name__)
+
+try:
+    # ISA-L's SIMD inflate and CRC-32 are several times faster than zlib's when
+    # unpacking uploads and checksumming archive members. Deflate stays on zlib:
+    # isal's compressobj only takes levels 0-3, and the API imports this module too.
+    from isal import isal_zlib
+    zipfile.zlib = types.SimpleNamespace(**vars(zlib))
+    zipfile.zlib.decompressobj = isal_zlib.decompressobj
+    zipfile.crc32 = isal_zlib.crc32
+except ImportError:
+    pass
+
 def get_db_session():
-    return SessionLocal()
+    return ScopedSession()
 
 STORAGE_PATH = os.getenv("STORAGE_PATH", "./storage")
 
-@celery_app.task(name="process_incoming_job")
+# Jobs with fewer DOCX files than this are converted inline instead of through a chord
+CHORD_THRESHOLD = int(os.getenv("CHORD_THRESHOLD", "32"))
+
+CONVERSION_TIMEOUT = 120  # 2 minutes max per file
+
+# A run over several files gets CONVERSION_TIMEOUT plus this much for each file after the first
+CONVERSION_TIMEOUT_PER_FILE = 10
+
+# Files a failed run leaves behind are retried one per run, for at most this long in total
+CONVERSION_RETRY_BUDGET = CONVERSION_TIMEOUT * 3
+
+
+def _max_conversion_time(files: int) -> int:
+    """Longest a _convert_batch call over this many files can take: its run, then every retry."""
+    return CONVERSION_TIMEOUT + CONVERSION_TIMEOUT_PER_FILE * (files - 1) + CONVERSION_RETRY_BUDGET
+
+
+# Added to the worst-case conversion time for profile cleanup, DB writes and archiving
+TIME_LIMIT_HEADROOM = 300
+
+# Files per conversion task when a large job fans out through a chord
+CONVERSION_BATCH_SIZE = int(os.getenv("CONVERSION_BATCH_SIZE", "50"))
+
+# Inline and batched conversions handle many files, above the default task time limits.
+# Both are sized for every file going through a single run, so the limits only fire if
+# something else hangs.
+INLINE_SOFT_TIME_LIMIT = _max_conversion_time(CHORD_THRESHOLD - 1) + TIME_LIMIT_HEADROOM
+BATCH_SOFT_TIME_LIMIT = _max_conversion_time(CONVERSION_BATCH_SIZE) + TIME_LIMIT_HEADROOM
+
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+EXTRACT_CHUNK_SIZE = 1024 * 1024
+
+# LibreOffice writes its config under HOME; built once rather than copied per run
+LIBREOFFICE_ENV = {**os.environ, "HOME": "/tmp"}
+
+# Fixed part of every conversion command; the output dir, profile and inputs follow it
+LIBREOFFICE_ARGV_PREFIX = ("libreoffice", "--headless", "--convert-to", "pdf", "--outdir")
+
+# Concurrent LibreOffice runs for an inline job. These jobs are small and finish within
+# one task, so by default they may use every core.
+INLINE_CONVERSION_WORKERS = int(os.getenv("INLINE_CONVERSION_WORKERS", os.cpu_count() or 1))
+
+
+def _batch_conversion_workers(concurrency: int) -> int:
+    # Shares the cores out across pool processes, which all convert batches at once
+    return max(1, (os.cpu_count() or 1) // (concurrency or 1))
+
+
+# Concurrent LibreOffice runs per batch. Multiplied by the worker's pool size, this should
+# stay near the number of cores; unless set, it is recomputed once the pool size is known.
+CONVERSION_WORKERS = int(os.getenv(
+    "CONVERSION_WORKERS", _batch_conversion_workers(celery_app.conf.worker_concurrency)
+))
+
+
+@worker_init.connect
+def size_conversion_workers(sender, **kwargs):
+    # The configured concurrency is read at import; --concurrency and the autoscale maximum
+    # are only settled here, before the pool forks, so its processes inherit the result
+    global CONVERSION_WORKERS
+    if "CONVERSION_WORKERS" not in os.environ:
+        CONVERSION_WORKERS = _batch_conversion_workers(sender.concurrency)
+
+
+# Threads used to unpack an uploaded archive
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", os.cpu_count() or 1))
+
+
+def _is_convertible(filename: str) -> bool:
+    return filename.lower().endswith(".docx") and not filename.startswith("~$")
+
+
+class _MappedFile(mmap.mmap):
+    """Read-only mmap that zipfile accepts as a file object (it checks seekable())."""
+
+    def seekable(self):
+        return True
+
+
+def _extract_members(zip_ref: zipfile.ZipFile, input_dir: str, members: list):
+    """Extract the given ZipInfo members of zip_ref in parallel.
+
+    Threads share the one ZipFile: its internal lock serialises the seek+read of the
+    compressed bytes, while inflating (which releases the GIL) runs concurrently. Members
+    are handed out one at a time so a few large documents don't leave the other threads idle.
+    """
+    if not members:
+        return
+    os.makedirs(input_dir, exist_ok=True)
+
+    def extract_one(info):
+        # Members are top-level names (no "/"), so joining them onto input_dir is safe.
+        # ZipFile.extract copies in 64 KiB chunks; 1 MiB cuts syscalls per document.
+        with zip_ref.open(info) as src, \
+                open(os.path.join(input_dir, info.filename), 'wb', buffering=0) as dst:
+            shutil.copyfileobj(src, dst, length=EXTRACT_CHUNK_SIZE)
+
+    with ThreadPoolExecutor(max_workers=min(EXTRACT_WORKERS, len(members))) as executor:
+        list(executor.map(extract_one, members))
+
+
+# LibreOffice user profiles created by this process and not currently in use. Building a
+# fresh profile is a large share of LibreOffice's startup cost, so runs borrow one instead.
+_idle_profiles = []
+_created_profiles = []
+_profile_ids = itertools.count()
+
+
+def _reset_profiles():
+    # Pool processes must not borrow profiles the parent may still be using
+    global _idle_profiles, _created_profiles
+    _idle_profiles = []
+    _created_profiles = []
+
+
+def _remove_profiles(**kwargs):
+    for profile_dir in _created_profiles:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+
+os.register_at_fork(after_in_child=_reset_profiles)
+# atexit covers the main process; Celery pool children are cleaned up by worker_process_shutdown
+atexit.register(_remove_profiles)
+worker_process_shutdown.connect(_remove_profiles)
+
+
+@contextlib.contextmanager
+def _borrow_profile():
+    """Lend out a LibreOffice profile directory that no other run is using.
+
+    The most recently returned profile goes out first, so sequential runs keep reusing one.
+    list.pop/append are atomic, which makes this safe across conversion threads.
+    """
+    try:
+        profile_dir = _idle_profiles.pop()
+    except IndexError:
+        profile_dir = f"/tmp/lo_{os.getpid()}_{next(_profile_ids)}"
+        _created_profiles.append(profile_dir)
+    try:
+        yield profile_dir
+    except BaseException:
+        # A killed or crashed run can leave the profile locked or half-written; never reuse it
+        _created_profiles.remove(profile_dir)
+        shutil.rmtree(profile_dir, ignore_errors=True)
+        raise
+    _idle_profiles.append(profile_dir)
+
+
+def _run_libreoffice(cmd: list, timeout: float) -> subprocess.CompletedProcess:
+    """Run a LibreOffice command in its own process group.
+
+    The libreoffice wrapper starts soffice.bin as a child, so on timeout the whole group is
+    killed; a surviving soffice.bin would hold its profile and swallow later runs.
+    """
+    with subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=LIBREOFFICE_ENV,
+        start_new_session=True,
+    ) as proc:
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(proc.pid, signal.SIGKILL)
+            proc.communicate()
+            raise
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def _has_pdf(output_dir: str, filename: str) -> bool:
+    return os.path.exists(os.path.join(output_dir, os.path.splitext(filename)[0] + ".pdf"))
+
+
+def _convert_batch(input_dir: str, output_dir: str, filenames: list, timeout: float = None) -> dict:
+    """Convert all filenames with a single LibreOffice run.
+
+    Each file is judged by whether its PDF exists, whatever the exit status, so a crash or
+    timeout only costs the files it left unconverted. Those are then retried one per run,
+    within CONVERSION_RETRY_BUDGET.
+    Returns a dict mapping each filename to an error message, or None if its PDF was produced.
+    """
+    if timeout is None:
+        timeout = CONVERSION_TIMEOUT + CONVERSION_TIMEOUT_PER_FILE * (len(filenames) - 1)
+    error = "Invalid file format or corrupted DOCX."
+    try:
+        with _borrow_profile() as profile_dir:
+            cmd = [
+                *LIBREOFFICE_ARGV_PREFIX,
+                output_dir,
+                f"-env:UserInstallation=file://{profile_dir}",
+                *[os.path.join(input_dir, filename) for filename in filenames]
+            ]
+            result = _run_libreoffice(cmd, timeout=timeout)
+            # Raising inside the block keeps a failed run's profile out of the pool
+            result.check_returncode()
+        stderr = result.stderr
+    except subprocess.TimeoutExpired as e:
+        error = "Conversion timed out"
+        stderr = e.stderr or b""
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr
+    except Exception as e:
+        return {filename: str(e) for filename in filenames}
+
+    # LibreOffice can exit 0 when a document fails to load, and a crash can follow PDFs
+    # it already wrote, so check for each PDF
+    errors = {filename: None if _has_pdf(output_dir, filename) else error for filename in filenames}
+
+    failed = [filename for filename, message in errors.items() if message]
+    if failed and len(filenames) > 1:
+        # A bad document can take its run down with it; alone, each file gets its own timeout,
+        # cut short once the budget runs out so a batch of hanging documents stays bounded
+        deadline = time.monotonic() + CONVERSION_RETRY_BUDGET
+        for filename in failed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                errors[filename] = "Conversion timed out"
+                continue
+            errors.update(_convert_batch(input_dir, output_dir, [filename], min(CONVERSION_TIMEOUT, remaining)))
+    elif failed:
+        logger.error("LibreOffice Error (%s): %s", failed[0], stderr.decode())
+    return errors
+
+
+def _convert_parallel(input_dir: str, output_dir: str, filenames: list, workers: int) -> dict:
+    """Split filenames across up to workers concurrent LibreOffice runs.
+
+    Threads are enough here since each one only waits on its subprocess, and Celery's
+    prefork children are daemonic so they cannot start a process pool of their own.
+    """
+    workers = min(workers, len(filenames))
+    errors = {}
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [
+            executor.submit(_convert_batch, input_dir, output_dir, filenames[i::workers])
+            for i in range(workers)
+        ]
+        for future in futures:
+            errors.update(future.result())
+    finally:
+        # If a soft time limit interrupts the wait, don't block on runs still in flight;
+        # each one ends on its own timeout
+        executor.shutdown(wait=False, cancel_futures=True)
+    return errors
+
+
+def _record_results(db, files: list, errors: dict) -> int:
+    """Store outcomes for (file_id, filename) pairs with one bulk UPDATE and return how many converted."""
+    db.execute(update(JobFile), [
+        {
+            "id": file_id,
+            "status": FileStatus.FAILED if errors[filename] else FileStatus.COMPLETED,
+            "error_message": errors[filename],
+        }
+        for file_id, filename in files
+    ])
+    db.commit()
+    return sum(errors[filename] is None for _, filename in files)
+
+
+@celery_app.task(
+    name="process_incoming_job",
+    soft_time_limit=INLINE_SOFT_TIME_LIMIT,
+    time_limit=INLINE_SOFT_TIME_LIMIT + 30,
+)
 def process_incoming_job(job_id: str, zip_path: str):
     db = get_db_session()
     if isinstance(job_id, str):
@@ -21,48 +316,58 @@ def process_incoming_job(job_id: str, zip_path: str):
     job = db.query(Job).filter(Job.id == job_id).first()
     
     if not job:
-        db.close()
+        ScopedSession.remove()
         return "Job not found"
 
+    # Hoisted out of the per-file loops below
+    job_key = str(job_id)
     job_dir = os.path.dirname(zip_path)
     input_dir = os.path.join(job_dir, "input")
     output_dir = os.path.join(job_dir, "output")
     os.makedirs(output_dir, exist_ok=True)
 
     try:
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(input_dir)
-        
-        all_files = [
-            f for f in os.listdir(input_dir) 
-            if os.path.isfile(os.path.join(input_dir, f))
-        ]
+        # The central directory is parsed once and the handle reused for extraction. Mapping the
+        # file ourselves keeps ZipFile from reference-counting (and closing) it across threads,
+        # and turns its header lookups and member reads into page-cache copies, not read()s.
+        # An empty upload cannot be mapped; the ValueError fails the job like a corrupt ZIP.
+        with open(zip_path, 'rb') as zip_file, \
+                _MappedFile(zip_file.fileno(), 0, access=mmap.ACCESS_READ) as zip_map, \
+                zipfile.ZipFile(zip_map, 'r') as zip_ref:
+            # Only top-level files become JobFiles; directory entries and nested files are skipped.
+            # Later duplicates win, as they would when extracting.
+            members = {info.filename: info for info in zip_ref.infolist() if "/" not in info.filename}
 
-        conversion_tasks = []
-        for filename in all_files:
-            if filename.lower().endswith(".docx") and not filename.startswith("~$"):
-                job_file = JobFile(job_id=job.id, filename=filename, status=FileStatus.PENDING)
-                db.add(job_file)
-            else:
-                job_file = JobFile(
-                    job_id=job.id, 
-                    filename=filename, 
-                    status=FileStatus.FAILED, 
-                    error_message="Invalid file format or corrupted DOCX."
-                )
-                db.add(job_file)
-
-        # Batch commit all JobFile entries
-        db.commit()
+            # Rejected entries are only recorded, never written to disk. Passing ZipInfo objects
+            # spares each extraction a name lookup in the central directory.
+            _extract_members(zip_ref, input_dir, [info for name, info in members.items() if _is_convertible(name)])
 
-        # Create tasks after committing so job_file.id is available
-        for job_file in job.files:
-            if job_file.status == FileStatus.PENDING:
-                task = convert_file_task.s(str(job.id), job_file.filename, job_file.id)
-                conversion_tasks.append(task)
+        rows = []
+        for filename in members:
+            if _is_convertible(filename):
+                rows.append({"job_id": job_id, "filename": filename, "status": FileStatus.PENDING, "error_message": None})
+            else:
+                rows.append({
+                    "job_id": job_id, 
+                    "filename": filename, 
+                    "status": FileStatus.FAILED, 
+                    "error_message": "Invalid file format or corrupted DOCX."
+                })
 
+        # One executemany INSERT ... RETURNING for every row, without building ORM objects
+        pending = []
+        if rows:
+            inserted = db.execute(
+                insert(JobFile).returning(JobFile.id, JobFile.filename, JobFile.status), rows
+            )
+            pending = [
+                (file_id, filename)
+                for file_id, filename, status in inserted
+                if status == FileStatus.PENDING
+            ]
 
-        if not conversion_tasks:
+        # The file rows and the job status share one commit
+        if not pending:
             job.status = JobStatus.FAILED
             job.finished_at = datetime.now(timezone.utc)
             db.commit()
@@ -70,113 +375,164 @@ def process_incoming_job(job_id: str, zip_path: str):
 
         job.status = JobStatus.IN_PROGRESS
 
+        # Must commit before dispatch: conversion tasks update these rows and archive_job_task
+        # sets the final status, which a later commit here could overwrite
         db.commit()
-        callback = archive_job_task.s(job_id)
-        chord(conversion_tasks)(callback)
+
+        if len(pending) < CHORD_THRESHOLD:
+            # Small jobs skip the chord and broker round-trips; convert them here in parallel
+            errors = _convert_parallel(
+                input_dir, output_dir, [name for _, name in pending], INLINE_CONVERSION_WORKERS
+            )
+            _record_results(db, pending, errors)
+            _archive_job(db, job_id)
+        else:
+            # One task per CONVERSION_BATCH_SIZE files keeps broker messages and result writes per job low
+            conversion_tasks = [
+                convert_batch_task.s(job_key, pending[i:i + CONVERSION_BATCH_SIZE])
+                for i in range(0, len(pending), CONVERSION_BATCH_SIZE)
+            ]
+            # Without the errback, a batch killed by its hard time limit would leave the job IN_PROGRESS
+            callback = archive_job_task.s(job_key).on_error(fail_job_task.s(job_key))
+            chord(conversion_tasks)(callback)
 
     except Exception as e:
-        job.status = JobStatus.FAILED
-        print(f"Error processing job {job_id}: {e}")
-        db.commit()
+        # Includes SoftTimeLimitExceeded; a hard kill is left to the fail_job_task errback
+        logger.exception("Error processing job %s: %s", job_id, e)
+        # A failed statement leaves the transaction unusable until it is rolled back
+        db.rollback()
+        _fail_job(db, job_id)
+    finally:
+        ScopedSession.remove()
+
+
+@celery_app.task(
+    name="convert_batch_task",
+    soft_time_limit=BATCH_SOFT_TIME_LIMIT,
+    time_limit=BATCH_SOFT_TIME_LIMIT + 30,
+)
+def convert_batch_task(job_id: str, files: list):
+    """Convert a chunk of [file_id, filename] pairs across up to CONVERSION_WORKERS LibreOffice runs.
+
+    Returns the number of files converted, which the chord passes to archive_job_task.
+    """
+    db = get_db_session()
+    try:
+        job_dir = os.path.join(STORAGE_PATH, str(job_id))
+        input_dir = os.path.join(job_dir, "input")
+        output_dir = os.path.join(job_dir, "output")
+
+        try:
+            errors = _convert_parallel(
+                input_dir, output_dir, [filename for _, filename in files], CONVERSION_WORKERS
+            )
+        except SoftTimeLimitExceeded:
+            # Record what finished and fail the rest, so the chord can still archive the job
+            logger.error("Conversion batch for job %s hit its time limit", job_id)
+            errors = {
+                filename: None if _has_pdf(output_dir, filename) else "Conversion timed out"
+                for _, filename in files
+            }
+        return _record_results(db, files, errors)
     finally:
-        db.close()
+        ScopedSession.remove()
 
 
 @celery_app.task(name="convert_file_task")
 def convert_file_task(job_id: str, filename: str, db_file_id: int):
-    db = get_db_session()
-    job_file = db.query(JobFile).filter(JobFile.id == db_file_id).first()
-    
-    if isinstance(job_id, str):
-        job_id_obj = uuid.UUID(job_id)
-    else:
-        job_id_obj = job_id
-        
+    # Kept so single-file messages queued before batched dispatch still drain
+    return convert_batch_task(job_id, [[db_file_id, filename]])
+
+
+def _archive_job(db, job_id: uuid.UUID):
+    """Zip the job's converted PDFs and record its final status."""
     job_dir = os.path.join(STORAGE_PATH, str(job_id))
-    input_path = os.path.join(job_dir, "input", filename)
     output_dir = os.path.join(job_dir, "output")
-    
+    zip_filename = "result.zip"
+    zip_path_abs = os.path.join(job_dir, zip_filename)
+
     try:
-        cmd = [
-            "libreoffice", 
-            "--headless", 
-            f"-env:UserInstallation=file:///tmp/lo_{job_id}_{db_file_id}",
-            "--convert-to", "pdf", 
-            input_path, 
-            "--outdir", output_dir
+        # The DB already knows which files converted, so neither a directory scan
+        # nor a pass over the chord results is needed
+        completed = [
+            filename for (filename,) in db.query(JobFile.filename).filter(
+                JobFile.job_id == job_id, JobFile.status == FileStatus.COMPLETED
+            )
         ]
-        env = os.environ.copy()
-        env['HOME'] = '/tmp'
-
-        result = subprocess.run(
-            cmd, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            env=env,  # Pass the modified environment
-            timeout=120  # 2 minutes max per file
-        )
-        
-        if result.returncode == 0:
-            job_file.status = FileStatus.COMPLETED
+        # PDFs are already compressed internally; storing them skips a pointless DEFLATE pass
+        with zipfile.ZipFile(zip_path_abs, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zipf:
+            for filename in completed:
+                pdf_name = os.path.splitext(filename)[0] + ".pdf"
+                pdf_path = os.path.join(output_dir, pdf_name)
+                # Size known up front, so ZIP64 headers are only written when needed
+                zinfo = zipfile.ZipInfo.from_file(pdf_path, pdf_name)
+                zinfo.compress_type = zipfile.ZIP_STORED
+                # Add to zip with just the filename (no full path), streaming 1 MiB at a time
+                with open(pdf_path, 'rb') as fsrc, zipf.open(zinfo, 'w') as fdst:
+                    shutil.copyfileobj(fsrc, fdst, length=ARCHIVE_CHUNK_SIZE)
+
+        if completed:
+            # Recorded so downloads can answer If-None-Match from the DB, without touching storage
+            with open(zip_path_abs, 'rb') as f:
+                zip_sha256 = hashlib.file_digest(f, "sha256").hexdigest()
+            values = {
+                "status": JobStatus.COMPLETED,
+                "zip_path": f"{job_id}/{zip_filename}",
+                "zip_sha256": zip_sha256,
+            }
         else:
-            job_file.status = FileStatus.FAILED
-            job_file.error_message = "Invalid file format or corrupted DOCX."
-            print(f"LibreOffice Error ({filename}): {result.stderr.decode()}")
+            values = {"status": JobStatus.FAILED, "zip_path": None}
 
-    except subprocess.TimeoutExpired:
-        job_file.status = FileStatus.FAILED
-        job_file.error_message = "Conversion timed out"
     except Exception as e:
-        job_file.status = FileStatus.FAILED
-        job_file.error_message = str(e)
-    
-    
-    final_status = job_file.status.value if job_file.status else "UNKNOWN"
-    
+        values = {"status": JobStatus.FAILED}
+        logger.exception("Archiving error for job %s: %s", job_id, e)
+
+    # One UPDATE by primary key; the Job row itself is never loaded
+    db.execute(
+        update(Job).where(Job.id == job_id).values(finished_at=datetime.now(timezone.utc), **values)
+    )
     db.commit()
-    db.close()
-    
-    return final_status
 
 
 @celery_app.task(name="archive_job_task")
 def archive_job_task(results, job_id: str):
     db = get_db_session()
-    if isinstance(job_id, str):
-        job_id = uuid.UUID(job_id)
-    job = db.query(Job).filter(Job.id == job_id).first()
-    
-    job_dir = os.path.join(STORAGE_PATH, str(job_id))
-    output_dir = os.path.join(job_dir, "output")
-    zip_filename = "result.zip"
-    zip_path_abs = os.path.join(job_dir, zip_filename)
-
     try:
-        files_to_zip = False
-        with zipfile.ZipFile(zip_path_abs, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            if os.path.exists(output_dir):
-                for root, _, files in os.walk(output_dir):
-                    for file in files:
-                        if file.endswith(".pdf"):
-                            files_to_zip = True
-                            # Add to zip with just the filename (no full path)
-                            zipf.write(os.path.join(root, file), arcname=file)
-
-        job.status = JobStatus.COMPLETED
-        job.finished_at = datetime.now(timezone.utc)
-        
-        if files_to_zip:
-            job.zip_path = f"{job_id}/{zip_filename}"
-        else:
-            job.zip_path = None
-            if not any(r == FileStatus.COMPLETED for r in results):
-                 job.status = JobStatus.FAILED
+        if isinstance(job_id, str):
+            job_id = uuid.UUID(job_id)
+        _archive_job(db, job_id)
+        return "Job Finished"
+    finally:
+        ScopedSession.remove()
 
 
-    except Exception as e:
-        job.status = JobStatus.FAILED
-        print(f"Archiving error for job {job_id}: {e}")
-    
+def _fail_job(db, job_id: uuid.UUID):
+    """Mark the job FAILED, along with any of its files that never got a result."""
+    db.execute(
+        update(JobFile)
+        .where(JobFile.job_id == job_id, JobFile.status == FileStatus.PENDING)
+        .values(status=FileStatus.FAILED, error_message="Conversion did not finish")
+    )
+    db.execute(
+        update(Job).where(Job.id == job_id).values(
+            status=JobStatus.FAILED, finished_at=datetime.now(timezone.utc)
+        )
+    )
     db.commit()
-    db.close()
-    return "Job Finished"
\ No newline at end of file
+
+
+@celery_app.task(name="fail_job_task")
+def fail_job_task(request, exc, traceback, job_id: str):
+    """Errback that fails a job whose processing, conversion or archiving task died.
+
+    Celery passes the failed task's request, exception and traceback first. A task killed by
+    its hard time limit never records its files, so any still PENDING are failed as well.
+    """
+    db = get_db_session()
+    try:
+        if isinstance(job_id, str):
+            job_id = uuid.UUID(job_id)
+        logger.error("Job %s failed: %r", job_id, exc)
+        _fail_job(db, job_id)
+    finally:
+        ScopedSession.remove()
@@ -1,15 +1,17 @@
 import pytest
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import StaticPool, NullPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from fastapi.testclient import TestClient
 from unittest.mock import patch
 
 from app.main import app
-from app.database import Base, get_db
-from app.tasks import SessionLocal as WorkerSessionLocal
+from app.database import Base, get_async_db
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
+# Shared-cache in-memory DB so the sync fixtures and the async API see the same tables
+SQLALCHEMY_DATABASE_URL = "sqlite:///file:testdb?mode=memory&cache=shared&uri=true"
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///file:testdb?mode=memory&cache=shared&uri=true"
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, 
@@ -23,7 +25,7 @@ def db_session():
     Base.metadata.create_all(bind=engine)
     db = TestingSessionLocal()
     try:
-        with patch("app.tasks.SessionLocal", TestingSessionLocal):
+        with patch("app.tasks.ScopedSession", scoped_session(TestingSessionLocal)):
             yield db
     finally:
         db.close()
@@ -31,10 +33,15 @@ def db_session():
 
 @pytest.fixture(scope="function")
 def client(db_session):
-    def override_get_db():
-        yield db_session
+    # NullPool: every TestClient runs its own event loop, so connections must not be reused
+    async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+    AsyncTestingSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
 
-    app.dependency_overrides[get_db] = override_get_db
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
     with TestClient(app) as c:
         yield c
     app.dependency_overrides.clear()
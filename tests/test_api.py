@@ -1,6 +1,6 @@
 import pytest
 from unittest.mock import patch
-from app.models import Job, JobStatus
+from app.models import Job, JobFile, JobStatus, FileStatus
 
 def test_submit_job_valid_zip(client):
     import io
@@ -11,7 +11,7 @@ def test_submit_job_valid_zip(client):
         zf.writestr("test.docx", "dummy content")
     file_like.seek(0)
 
-    with patch("app.tasks.process_incoming_job.delay") as mock_task:
+    with patch("app.tasks.process_incoming_job.apply_async") as mock_task:
         response = client.post(
             "/api/v1/jobs",
             files={"file": ("test.zip", file_like, "application/zip")}
@@ -22,6 +22,25 @@ def test_submit_job_valid_zip(client):
     assert "job_id" in data
     assert data["status"] == "PENDING"
     assert mock_task.called  # Verify Celery was triggered
+    assert mock_task.call_args.kwargs["link_error"].task == "fail_job_task"
+
+def test_submit_job_large_upload_saved_intact(client, tmp_path):
+    import os
+    # Over Starlette's 1 MB spool limit, so the upload is on disk and copied with sendfile
+    payload = os.urandom(3 * 1024 * 1024)
+
+    with patch("app.routers.jobs.STORAGE_PATH", str(tmp_path)), \
+         patch("app.tasks.process_incoming_job.apply_async"), \
+         patch("os.sendfile", wraps=os.sendfile) as mock_sendfile:
+        response = client.post(
+            "/api/v1/jobs",
+            files={"file": ("large.zip", payload, "application/zip")}
+        )
+
+    assert response.status_code == 202
+    assert mock_sendfile.called
+    saved = tmp_path / response.json()["job_id"] / "upload.zip"
+    assert saved.read_bytes() == payload
 
 def test_submit_job_invalid_extension(client):
     response = client.post(
@@ -37,12 +56,17 @@ def test_get_job_status(client, db_session):
     job_id = uuid.uuid4()
     job = Job(id=job_id, status=JobStatus.IN_PROGRESS)
     db_session.add(job)
+    db_session.add(JobFile(job_id=job_id, filename="a.docx", status=FileStatus.COMPLETED))
     db_session.commit()
 
     response = client.get(f"/api/v1/jobs/{str(job_id)}")
     
     assert response.status_code == 200
+    assert response.json()["job_id"] == str(job_id)
     assert response.json()["status"] == "IN_PROGRESS"
+    assert response.json()["files"] == [
+        {"filename": "a.docx", "status": "COMPLETED", "error_message": None}
+    ]
 
 def test_download_job_not_ready(client, db_session):
     import uuid
@@ -52,4 +76,54 @@ def test_download_job_not_ready(client, db_session):
     db_session.commit()
 
     response = client.get(f"/api/v1/jobs/{str(job_id)}/download")
-    assert response.status_code == 400
\ No newline at end of file
+    assert response.status_code == 400
+
+def test_download_job_result(client, db_session, tmp_path):
+    import uuid
+    job_id = uuid.uuid4()
+    (tmp_path / str(job_id)).mkdir()
+    (tmp_path / str(job_id) / "result.zip").write_bytes(b"zip-bytes")
+    job = Job(
+        id=job_id, status=JobStatus.COMPLETED, zip_path=f"{job_id}/result.zip",
+        zip_sha256="ab" * 32
+    )
+    db_session.add(job)
+    db_session.commit()
+
+    with patch("app.routers.jobs.STORAGE_PATH", str(tmp_path)):
+        response = client.get(f"/api/v1/jobs/{str(job_id)}/download")
+        revalidated = client.get(
+            f"/api/v1/jobs/{str(job_id)}/download",
+            headers={"If-None-Match": response.headers["etag"]}
+        )
+
+    assert response.status_code == 200
+    assert response.content == b"zip-bytes"
+    assert response.headers["content-length"] == "9"
+    assert response.headers["cache-control"] == "private, max-age=3600"
+    assert response.headers["etag"] == f'"{"ab" * 32}"'
+    assert revalidated.status_code == 304
+
+def test_upgrade_schema_adds_missing_column_and_indexes(tmp_path):
+    from sqlalchemy import create_engine, inspect, text
+    from app.models import upgrade_schema
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    # The tables as a database created before zip_sha256 and the indexes had them
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE jobs (id CHAR(32) PRIMARY KEY, status VARCHAR(11), "
+            "created_at DATETIME, finished_at DATETIME, zip_path VARCHAR)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE job_files (id INTEGER PRIMARY KEY, job_id CHAR(32), "
+            "filename VARCHAR NOT NULL, status VARCHAR(9), error_message VARCHAR)"
+        ))
+
+    upgrade_schema(engine)
+    upgrade_schema(engine)  # a second run finds nothing left to do
+
+    inspector = inspect(engine)
+    assert "zip_sha256" in {column["name"] for column in inspector.get_columns("jobs")}
+    assert "ix_jobs_status" in {index["name"] for index in inspector.get_indexes("jobs")}
+    assert "ix_jobfile_job_status" in {index["name"] for index in inspector.get_indexes("job_files")}
@@ -1,8 +1,12 @@
 import os
+import threading
+import time
 import pytest
+import subprocess
 import uuid
-from unittest.mock import patch, MagicMock
-from app.tasks import process_incoming_job, convert_file_task, archive_job_task
+from unittest.mock import patch
+from app import tasks
+from app.tasks import process_incoming_job, convert_batch_task, convert_file_task, archive_job_task, fail_job_task
 from app.models import Job, JobFile, JobStatus, FileStatus
 
 @pytest.fixture
@@ -14,13 +18,26 @@ def dummy_zip(tmp_path):
         zf.writestr("ignore_me.txt", "content") # Should be ignored
     return str(zip_path)
 
+def _fake_libreoffice(cmd, **kwargs):
+    # Write an empty PDF for every input, as a successful LibreOffice run would
+    output_dir = cmd[cmd.index("--outdir") + 1]
+    os.makedirs(output_dir, exist_ok=True)
+    for arg in cmd:
+        if arg.endswith(".docx"):
+            pdf_name = os.path.splitext(os.path.basename(arg))[0] + ".pdf"
+            open(os.path.join(output_dir, pdf_name), "wb").close()
+    return subprocess.CompletedProcess(cmd, 0, stderr=b"")
+
+def _profile_arg(cmd):
+    return next(arg for arg in cmd if arg.startswith("-env:UserInstallation="))
+
 def test_process_incoming_job_unzipping(db_session, dummy_zip):
     job_id = str(uuid.uuid4())
     job = Job(id=uuid.UUID(job_id), status=JobStatus.PENDING)
     db_session.add(job)
     db_session.commit()
 
-    with patch("app.tasks.chord") as mock_chord:
+    with patch("app.tasks.chord") as mock_chord, patch("app.tasks.CHORD_THRESHOLD", 0):
         process_incoming_job(job_id, dummy_zip)
 
     db_session.refresh(job)
@@ -36,6 +53,168 @@ def test_process_incoming_job_unzipping(db_session, dummy_zip):
     assert txt_file.error_message == "Invalid file format or corrupted DOCX."
     assert mock_chord.called 
 
+    input_dir = os.path.join(os.path.dirname(dummy_zip), "input")
+    assert os.listdir(input_dir) == ["doc1.docx"]  # rejected entries are not extracted
+
+
+def test_process_small_job_converts_inline(db_session, tmp_path):
+    job_id = str(uuid.uuid4())
+    job_dir = tmp_path / job_id
+    job_dir.mkdir()
+    zip_path = job_dir / "upload.zip"
+    import zipfile
+    with zipfile.ZipFile(zip_path, 'w') as zf:
+        zf.writestr("doc1.docx", "content")
+        zf.writestr("doc2.docx", "content")
+
+    job = Job(id=uuid.UUID(job_id), status=JobStatus.PENDING)
+    db_session.add(job)
+    db_session.commit()
+
+    # Hold both runs open together so they really overlap
+    barrier = threading.Barrier(2, timeout=5)
+    def concurrent_libreoffice(cmd, **kwargs):
+        barrier.wait()
+        return _fake_libreoffice(cmd, **kwargs)
+
+    with patch("app.tasks.chord") as mock_chord, \
+         patch("app.tasks.STORAGE_PATH", str(tmp_path)), \
+         patch("app.tasks.INLINE_CONVERSION_WORKERS", 2), \
+         patch("app.tasks._run_libreoffice", side_effect=concurrent_libreoffice) as mock_run:
+        process_incoming_job(job_id, str(zip_path))
+
+    db_session.refresh(job)
+    assert not mock_chord.called
+    assert mock_run.call_count == 2  # one LibreOffice run per worker
+    profiles = {_profile_arg(call.args[0]) for call in mock_run.call_args_list}
+    assert len(profiles) == 2  # concurrent runs must not share a user profile
+    assert job.status == JobStatus.COMPLETED
+    assert job.zip_path == f"{job_id}/result.zip"
+    assert len(job.zip_sha256) == 64
+    with zipfile.ZipFile(tmp_path / job.zip_path) as result:
+        assert sorted(result.namelist()) == ["doc1.pdf", "doc2.pdf"]
+        assert all(i.compress_type == zipfile.ZIP_STORED for i in result.infolist())
+    assert all(f.status == FileStatus.COMPLETED for f in job.files)
+
+
+def _small_job(db_session, tmp_path, filenames):
+    job_id = str(uuid.uuid4())
+    job_dir = tmp_path / job_id
+    job_dir.mkdir()
+    zip_path = job_dir / "upload.zip"
+    import zipfile
+    with zipfile.ZipFile(zip_path, 'w') as zf:
+        for filename in filenames:
+            zf.writestr(filename, "content")
+
+    job = Job(id=uuid.UUID(job_id), status=JobStatus.PENDING)
+    db_session.add(job)
+    db_session.commit()
+    return job, str(zip_path)
+
+
+def test_inline_job_keeps_pdfs_written_before_crash(db_session, tmp_path):
+    job, zip_path = _small_job(db_session, tmp_path, ["good.docx", "bad.docx"])
+
+    def crash_on_bad(cmd, **kwargs):
+        _fake_libreoffice([arg for arg in cmd if not arg.endswith("bad.docx")])
+        return subprocess.CompletedProcess(cmd, -11, stderr=b"Segmentation fault")
+
+    with patch("app.tasks.STORAGE_PATH", str(tmp_path)), \
+         patch("app.tasks.INLINE_CONVERSION_WORKERS", 1), \
+         patch("app.tasks._run_libreoffice", side_effect=crash_on_bad) as mock_run:
+        process_incoming_job(str(job.id), zip_path)
+
+    db_session.refresh(job)
+    assert mock_run.call_count == 2  # the batch run, then bad.docx retried alone
+    statuses = {f.filename: f.status for f in job.files}
+    assert statuses == {"good.docx": FileStatus.COMPLETED, "bad.docx": FileStatus.FAILED}
+    assert job.status == JobStatus.COMPLETED
+
+
+def test_inline_job_retries_files_left_by_timeout(db_session, tmp_path):
+    job, zip_path = _small_job(db_session, tmp_path, ["doc0.docx", "doc1.docx", "doc2.docx", "hung.docx"])
+
+    def hang_on_hung(cmd, **kwargs):
+        if any(arg.endswith("hung.docx") for arg in cmd):
+            # The batch gets as far as doc0 before hanging
+            _fake_libreoffice([arg for arg in cmd if not arg.endswith(("doc1.docx", "doc2.docx", "hung.docx"))])
+            raise subprocess.TimeoutExpired(cmd, kwargs["timeout"])
+        return _fake_libreoffice(cmd, **kwargs)
+
+    with patch("app.tasks.STORAGE_PATH", str(tmp_path)), \
+         patch("app.tasks.INLINE_CONVERSION_WORKERS", 1), \
+         patch("app.tasks._run_libreoffice", side_effect=hang_on_hung) as mock_run:
+        process_incoming_job(str(job.id), zip_path)
+
+    db_session.refresh(job)
+    timeouts = [call.kwargs["timeout"] for call in mock_run.call_args_list]
+    assert sorted(timeouts) == [120, 120, 120, 150]  # doc0 is not converted again
+    hung = next(f for f in job.files if f.filename == "hung.docx")
+    assert hung.status == FileStatus.FAILED
+    assert hung.error_message == "Conversion timed out"
+    assert sum(f.status == FileStatus.COMPLETED for f in job.files) == 3
+
+
+def test_retries_stop_when_budget_runs_out(tmp_path):
+    clock = [0.0]
+
+    def hang(cmd, **kwargs):
+        clock[0] += kwargs["timeout"]
+        raise subprocess.TimeoutExpired(cmd, kwargs["timeout"])
+
+    filenames = [f"doc{i}.docx" for i in range(5)]
+    with patch("app.tasks._run_libreoffice", side_effect=hang) as mock_run, \
+         patch("app.tasks.time.monotonic", lambda: clock[0]):
+        errors = tasks._convert_batch(str(tmp_path), str(tmp_path), filenames)
+
+    timeouts = [call.kwargs["timeout"] for call in mock_run.call_args_list]
+    assert timeouts == [160, 120, 120, 120]  # the batch run, then retries until the budget is spent
+    assert set(errors.values()) == {"Conversion timed out"}
+
+
+def test_batch_conversion_workers_follow_pool_size():
+    pool = type("WorkController", (), {"concurrency": 2})()
+    with patch("app.tasks.CONVERSION_WORKERS", 1), \
+         patch.dict(os.environ), \
+         patch("os.cpu_count", return_value=8):
+        os.environ.pop("CONVERSION_WORKERS", None)
+        tasks.size_conversion_workers(sender=pool)
+        assert tasks.CONVERSION_WORKERS == 4
+
+        os.environ["CONVERSION_WORKERS"] = "3"
+        tasks.size_conversion_workers(sender=pool)
+        assert tasks.CONVERSION_WORKERS == 4  # an explicit setting is left alone
+
+
+def test_inline_soft_time_limit_fails_job_and_files(db_session, tmp_path):
+    job, zip_path = _small_job(db_session, tmp_path, ["doc1.docx"])
+
+    with patch("app.tasks.STORAGE_PATH", str(tmp_path)), \
+         patch("app.tasks._convert_parallel", side_effect=tasks.SoftTimeLimitExceeded()):
+        process_incoming_job(str(job.id), zip_path)
+
+    db_session.refresh(job)
+    assert job.status == JobStatus.FAILED
+    assert job.finished_at is not None
+    assert [f.error_message for f in job.files] == ["Conversion did not finish"]
+
+
+def test_inline_db_error_marks_job_failed(db_session, tmp_path):
+    job, zip_path = _small_job(db_session, tmp_path, ["doc1.docx"])
+
+    def failing_archive(db, *args):
+        db.add(JobFile(job_id=job.id, filename=None))  # violates NOT NULL
+        db.flush()
+
+    with patch("app.tasks.STORAGE_PATH", str(tmp_path)), \
+         patch("app.tasks._run_libreoffice", side_effect=_fake_libreoffice), \
+         patch("app.tasks._archive_job", side_effect=failing_archive):
+        process_incoming_job(str(job.id), zip_path)
+
+    db_session.refresh(job)
+    assert job.status == JobStatus.FAILED
+
 
 def test_convert_file_task_success(db_session, tmp_path):
     job_id = str(uuid.uuid4())
@@ -43,9 +222,8 @@ def test_convert_file_task_success(db_session, tmp_path):
     db_session.add(job_file)
     db_session.commit()
     
-    with patch("subprocess.run") as mock_run:
-        mock_run.return_value = MagicMock(returncode=0)
-        
+    with patch("app.tasks._run_libreoffice", side_effect=_fake_libreoffice) as mock_run, \
+         patch("app.tasks.STORAGE_PATH", str(tmp_path)):
         convert_file_task(job_id, "test.docx", job_file.id)
 
     db_session.refresh(job_file)
@@ -61,8 +239,8 @@ def test_convert_file_task_failure(db_session):
     db_session.add(job_file)
     db_session.commit()
 
-    with patch("subprocess.run") as mock_run:
-        mock_run.return_value = MagicMock(returncode=1, stderr=b"Conversion error")
+    with patch("app.tasks._run_libreoffice") as mock_run:
+        mock_run.return_value = subprocess.CompletedProcess([], 1, stderr=b"Conversion error")
         
         convert_file_task(job_id, "corrupt.docx", job_file.id)
 
@@ -70,6 +248,127 @@ def test_convert_file_task_failure(db_session):
     assert job_file.status == FileStatus.FAILED
     assert "Invalid file format or corrupted DOCX." in job_file.error_message
 
+def test_sequential_conversions_reuse_profile(db_session, tmp_path):
+    job_id = str(uuid.uuid4())
+    files = [JobFile(job_id=uuid.UUID(job_id), filename=f"doc{i}.docx") for i in range(2)]
+    db_session.add_all(files)
+    db_session.commit()
+
+    with patch("app.tasks._run_libreoffice", side_effect=_fake_libreoffice) as mock_run, \
+         patch("app.tasks.STORAGE_PATH", str(tmp_path)):
+        for job_file in files:
+            convert_file_task(job_id, job_file.filename, job_file.id)
+
+    profiles = {_profile_arg(call.args[0]) for call in mock_run.call_args_list}
+    assert len(profiles) == 1
+
+def test_timed_out_run_discards_profile(db_session, tmp_path):
+    job_id = str(uuid.uuid4())
+    files = [JobFile(job_id=uuid.UUID(job_id), filename=f"doc{i}.docx") for i in range(2)]
+    db_session.add_all(files)
+    db_session.commit()
+
+    def hang_once(cmd, **kwargs):
+        if mock_run.call_count == 1:
+            raise subprocess.TimeoutExpired(cmd, kwargs["timeout"])
+        return _fake_libreoffice(cmd, **kwargs)
+
+    with patch("app.tasks._run_libreoffice", side_effect=hang_once) as mock_run, \
+         patch("app.tasks.STORAGE_PATH", str(tmp_path)):
+        for job_file in files:
+            convert_file_task(job_id, job_file.filename, job_file.id)
+
+    first, second = (_profile_arg(call.args[0]) for call in mock_run.call_args_list)
+    assert first != second  # the killed run's profile may still be locked
+    assert first.removeprefix("-env:UserInstallation=file://") not in tasks._idle_profiles
+
+def test_run_libreoffice_timeout_kills_process_group(tmp_path):
+    pid_file = tmp_path / "child.pid"
+    # Stands in for the wrapper script and the soffice.bin it leaves running
+    cmd = ["sh", "-c", f"sleep 30 & echo $! > {pid_file}; wait"]
+
+    started = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        tasks._run_libreoffice(cmd, timeout=0.5)
+    # Had the child survived, it would hold the pipes open until its sleep ended
+    assert time.monotonic() - started < 10
+
+    child = int(pid_file.read_text())
+    for _ in range(50):
+        try:
+            with open(f"/proc/{child}/stat") as f:
+                if f.read().split(") ")[1].startswith("Z"):
+                    break
+        except FileNotFoundError:
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail("LibreOffice child survived the timeout")
+
+def test_convert_batch_task_partial_failure(db_session, tmp_path):
+    job_id = str(uuid.uuid4())
+    good = JobFile(job_id=uuid.UUID(job_id), filename="good.docx", status=FileStatus.PENDING)
+    bad = JobFile(job_id=uuid.UUID(job_id), filename="bad.docx", status=FileStatus.PENDING)
+    db_session.add_all([good, bad])
+    db_session.commit()
+
+    def convert_only_good(cmd, **kwargs):
+        return _fake_libreoffice([arg for arg in cmd if not arg.endswith("bad.docx")])
+
+    with patch("app.tasks._run_libreoffice", side_effect=convert_only_good) as mock_run, \
+         patch("app.tasks.STORAGE_PATH", str(tmp_path)), \
+         patch("app.tasks.CONVERSION_WORKERS", 1):
+        converted = convert_batch_task(job_id, [[good.id, "good.docx"], [bad.id, "bad.docx"]])
+
+    assert converted == 1
+    assert mock_run.call_count == 2  # the batch run, then bad.docx retried alone
+    db_session.refresh(good)
+    db_session.refresh(bad)
+    assert good.status == FileStatus.COMPLETED
+    assert bad.status == FileStatus.FAILED
+    assert bad.error_message == "Invalid file format or corrupted DOCX."
+
+def test_convert_batch_task_soft_time_limit(db_session, tmp_path):
+    job_id = str(uuid.uuid4())
+    done = JobFile(job_id=uuid.UUID(job_id), filename="done.docx", status=FileStatus.PENDING)
+    stuck = JobFile(job_id=uuid.UUID(job_id), filename="stuck.docx", status=FileStatus.PENDING)
+    db_session.add_all([done, stuck])
+    db_session.commit()
+    output_dir = tmp_path / job_id / "output"
+    output_dir.mkdir(parents=True)
+
+    def interrupted(*args):
+        (output_dir / "done.pdf").touch()
+        raise tasks.SoftTimeLimitExceeded()
+
+    with patch("app.tasks._convert_parallel", side_effect=interrupted), \
+         patch("app.tasks.STORAGE_PATH", str(tmp_path)):
+        converted = convert_batch_task(job_id, [[done.id, "done.docx"], [stuck.id, "stuck.docx"]])
+
+    assert converted == 1
+    db_session.refresh(done)
+    db_session.refresh(stuck)
+    assert done.status == FileStatus.COMPLETED
+    assert stuck.status == FileStatus.FAILED
+    assert stuck.error_message == "Conversion timed out"
+
+def test_fail_job_task_fails_job_and_pending_files(db_session):
+    job = Job(id=uuid.uuid4(), status=JobStatus.IN_PROGRESS)
+    converted = JobFile(job_id=job.id, filename="a.docx", status=FileStatus.COMPLETED)
+    pending = JobFile(job_id=job.id, filename="b.docx", status=FileStatus.PENDING)
+    db_session.add_all([job, converted, pending])
+    db_session.commit()
+
+    fail_job_task(None, TimeoutError(), None, str(job.id))
+
+    db_session.refresh(job)
+    db_session.refresh(converted)
+    db_session.refresh(pending)
+    assert job.status == JobStatus.FAILED
+    assert job.finished_at is not None
+    assert converted.status == FileStatus.COMPLETED
+    assert pending.status == FileStatus.FAILED
+
 def test_process_job_all_invalid_files(db_session, tmp_path):
     zip_path = tmp_path / "invalid.zip"
     import zipfile
@@ -91,6 +390,22 @@ def test_process_job_all_invalid_files(db_session, tmp_path):
     for f in job.files:
         assert f.status == FileStatus.FAILED
         assert f.error_message == "Invalid file format or corrupted DOCX."
+    assert not (tmp_path / "input").exists()  # nothing was extracted
+
+def test_process_job_empty_upload(db_session, tmp_path):
+    zip_path = tmp_path / "empty.zip"
+    zip_path.write_bytes(b"")
+
+    job_id = str(uuid.uuid4())
+    job = Job(id=uuid.UUID(job_id), status=JobStatus.PENDING)
+    db_session.add(job)
+    db_session.commit()
+
+    process_incoming_job(job_id, str(zip_path))
+
+    db_session.refresh(job)
+    assert job.status == JobStatus.FAILED
+    assert job.files == []
 
 def test_process_job_large_batch(db_session, tmp_path):
     # Create a zip with 1000 files
@@ -116,7 +431,55 @@ def test_process_job_large_batch(db_session, tmp_path):
     pending_files = [f for f in job.files if f.status == FileStatus.PENDING]
     assert len(pending_files) == 1000
     
-    # Verify chord was called with 1000 tasks
+    # Verify chord was called with 1000 files in batches of 50
     assert mock_chord.called
-    conversion_tasks = mock_chord.call_args[0][0]
-    assert len(list(conversion_tasks)) == 1000
+    conversion_tasks = list(mock_chord.call_args[0][0])
+    assert len(conversion_tasks) == 20
+    assert sum(len(task.args[1]) for task in conversion_tasks) == 1000
+    callback = mock_chord.return_value.call_args[0][0]
+    assert [errback.task for errback in callback.options["link_error"]] == ["fail_job_task"]
+
+def test_archive_job_without_completed_files(db_session, tmp_path):
+    job_id = str(uuid.uuid4())
+    (tmp_path / job_id).mkdir()
+    job = Job(id=uuid.UUID(job_id), status=JobStatus.IN_PROGRESS)
+    db_session.add(job)
+    db_session.add(JobFile(job_id=job.id, filename="bad.docx", status=FileStatus.FAILED))
+    db_session.commit()
+
+    with patch("app.tasks.STORAGE_PATH", str(tmp_path)):
+        archive_job_task([0], job_id)
+
+    db_session.refresh(job)
+    assert job.status == JobStatus.FAILED
+    assert job.zip_path is None
+    assert job.finished_at is not None
+
+def test_deflate_levels_survive_isal_patch(tmp_path):
+    import zipfile
+    zip_path = tmp_path / "deflated.zip"
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+        zf.writestr("doc.docx", "content" * 1000)
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.read("doc.docx") == b"content" * 1000
+
+def test_visibility_timeout_outlasts_task_time_limits():
+    from app.celery_worker import celery_app
+    time_limits = [
+        task.time_limit or celery_app.conf.task_time_limit
+        for name, task in celery_app.tasks.items() if not name.startswith("celery.")
+    ]
+    assert celery_app.conf.broker_transport_options["visibility_timeout"] > max(time_limits)
+
+def test_log_records_are_formatted_by_the_listener():
+    import logging
+    import queue
+    from app.celery_worker import _InProcessQueueHandler
+    log_queue = queue.SimpleQueue()
+    record = logging.LogRecord("app.tasks", logging.INFO, __file__, 1, "Job %s", ("abc",), None)
+
+    _InProcessQueueHandler(log_queue).handle(record)
+
+    queued = log_queue.get_nowait()
+    assert queued is record
+    assert queued.args == ("abc",)  # left for the listener thread to merge